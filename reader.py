@@ -2,26 +2,241 @@
 import re
 import os
 import datetime
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
+import multiprocessing
+import shelve
+from collections import namedtuple
+import numpy as np
+import piexif
+from PIL.ExifTags import GPSTAGS
 import csv
+try:
+    from numba import njit
+except ImportError:
+    # Numba is an optional accelerator; without it the decorated
+    # functions simply run as plain Python
+    def njit(*args, **kwargs):
+        def wrap(func):
+            return func
+        return wrap
 
-class ImageMeta:
-    @staticmethod
-    def __checkifileexist(filepath):
-        if os.path.isfile(filepath):
-            pass
+# On-disk cache of parsed EXIF data, created next to the script
+# (v2: the cached rows are ImageRow tuples, not dicts)
+CACHE_FILE = ".metacache.v2.db"
+
+# CSV column order for the two outputs, which is also the field order
+# of the row tuples built below
+IMAGE_CSV_COLUMNS = ['datetime', 'imgwidth', 'imgheight', 'focallength',
+                     'lat', 'lng', 'heading', 'altitude', 'yaw', 'pitch',
+                     'roll', 'senwidth', 'senheight', 'h_fov', 'imgname']
+VIDEO_CSV_COLUMNS = ['datetime', 'lat', 'lng', 'heading', 'altitude',
+                     'frame_start', 'frame_end']
+
+# One row of output, positional in CSV column order: no per-row key
+# strings and no per-field dict lookup at write time. Use ._asdict()
+# when a dict view is needed downstream.
+ImageRow = namedtuple("ImageRow", IMAGE_CSV_COLUMNS, defaults=("", "", "", ""))
+VideoRow = namedtuple("VideoRow", VIDEO_CSV_COLUMNS)
+
+# EXIF tag id of the GPS sub-IFD
+GPSINFO_TAG = 0x8825
+
+# Number of bytes read from the head of a JPEG for a metadata read.
+# The APP1 (EXIF) segment sits right at the start of the file and fits
+# well within this on virtually every camera.
+HEADER_BYTES = 1 << 16
+
+# EXIF tag ids for the tags readfromimage actually consumes, so the
+# values are looked up on the parsed mapping directly instead of first
+# building a name-labeled copy of every tag in the file
+WANTED_TAGS = {"DateTimeOriginal": 0x9003,
+               "ImageWidth":       0x0100,
+               "ImageLength":      0x0101,
+               "FocalLength":      0x920A,
+               "UserComment":      0x9286,
+               "Make":             0x010F,
+               "Model":            0x0110}
+
+# Camera sensor constants per (make, model) of the devices measured so
+# far; looked up in O(1) per image instead of branching on Make/Model
+SENSOR_SPECS = {
+    ("samsung", "sm-a505f"): {"senwidth":  5.18,   # millimeters
+                              "senheight": 3.89,   # millimeters
+                              "h_fov":     66.8},  # degrees - Field of view
+}
+
+
+def _check_file_exists(filepath):
+    """Raise if the given path does not point to an existing file."""
+    if not os.path.isfile(filepath):
+        raise ValueError("No file found with path {}".format(filepath))
+
+
+def _cache_key(filepath):
+    """
+    Cache key for an image that changes whenever the file on disk
+    changes, so a stale entry can never be served.
+    """
+    st = os.stat(filepath)
+    return "{}:{}:{}".format(os.path.abspath(filepath), st.st_mtime_ns, st.st_size)
+
+
+# Pattern to split the location line of an OpenCamera .srt block
+_SRT_LOC_SPLIT = re.compile('[°\'\"\,\ ]')
+
+# Pattern to split the UserComment EXIF tag into its yaw/pitch/roll parts
+_USER_COMMENT_SPLIT = re.compile("[\x00^:,]")
+
+
+def _iter_srt_blocks(f):
+    """
+    Generator that yields one subtitle block (list of lines) at a time
+    from an open .srt file. Blocks are separated by blank lines, so the
+    whole file never needs to be held in memory.
+    """
+    block = list()
+    for line in f:
+        line = line.rstrip("\n")
+        if line == "":
+            if block:
+                yield block
+                block = list()
         else:
-            raise ValueError("No file found with path {}".format(filepath))
-    
+            block.append(line)
+    if block:
+        yield block
+
+
+def _parse_srt_time(s):
+    """
+    Parse a fixed-format HH:MM:SS,mmm subtitle timestamp into a
+    datetime.time. A direct slice-and-int parse avoids strptime, which
+    re-reads the format string on every call.
+    """
+    return datetime.time(int(s[0:2]), int(s[3:5]), int(s[6:8]), int(s[9:12]) * 1000)
+
+
+def _decode(value):
+    """
+    Decode ASCII tag values from piexif, which come out as raw bytes.
+    Non-string values (rationals, ints) are passed through untouched.
+    """
+    if isinstance(value, bytes):
+        return value.decode("ascii", errors="replace")
+    return value
+
+
+def _readone(filepath):
+    """
+    Worker function to read the meta data of a single image in a batch.
+    Kept at module level so it can be pickled to the worker processes.
+    The rational EXIF numbers are returned unconverted so the parent
+    can convert the whole batch in one vectorized pass.
+    """
+    meta, raw = ImageMeta._extract(filepath)
+    meta["imgname"] = os.path.basename(filepath)
+    return filepath, meta, raw
+
+
+def _dms_to_decimal_batch(dms, refs):
+    """
+    Vectorized version of __get_decimal_from_dms for a whole batch.
+
+    INPUT:
+        dms(ndarray):   (N, 3, 2) array of (num, den) rationals for
+                        degrees, minutes and seconds
+        refs(ndarray):  (N,) array of location reference letters
+
+    RETURN
+        <ndarray>
+        (N,) array of decimal locations rounded to 6 places.
+    """
+    decimals = dms[:, 0, 0] / dms[:, 0, 1] \
+             + dms[:, 1, 0] / dms[:, 1, 1] / 60.0 \
+             + dms[:, 2, 0] / dms[:, 2, 1] / 3600.0
+    decimals[np.isin(refs, ("S", "W"))] *= -1
+    return np.round(decimals, 6)
+
+
+def _write_csv_atomic(rows, cols, path):
+    """
+    Write rows (tuples already in cols order) to a csv file at path.
+    The data goes to a temporary file first and is moved into place
+    atomically, so a reader holding the destination open (e.g. Excel)
+    never sees a half-written file and the caller never blocks on a
+    retry prompt.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, 'w', newline='', buffering=1<<20) as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(cols)
+        # writerows loops over the rows at C level instead of one
+        # Python writerow call per row
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+@njit(cache=True)
+def _dms_to_dec(dms):
+    """
+    Convert an (N, 3) array of integer (deg, min, sec) rows to decimal
+    degrees. Compiled by Numba on first use and cached on disk, so the
+    compile cost is paid once and long .srt files convert at C speed.
+    """
+    out = np.empty(dms.shape[0])
+    for i in range(dms.shape[0]):
+        out[i] = dms[i, 0] + dms[i, 1] / 60.0 + dms[i, 2] / 3600.0
+    return out
+
+
+def _finalize_batch(metas, raws):
+    """
+    Fill in the lat/lng/focallength/heading/altitude fields for a whole
+    batch at once. All the rational-to-float divisions are done as a
+    handful of NumPy array operations instead of per-image Python math.
+    """
+    lat_dms   = np.array([raw[0] for raw in raws], dtype=np.float64)
+    lat_refs  = np.array([raw[1] for raw in raws])
+    lng_dms   = np.array([raw[2] for raw in raws], dtype=np.float64)
+    lng_refs  = np.array([raw[3] for raw in raws])
+    rationals = np.array([raw[4:] for raw in raws], dtype=np.float64)
+
+    lats = _dms_to_decimal_batch(lat_dms, lat_refs)
+    lngs = _dms_to_decimal_batch(lng_dms, lng_refs)
+    values = rationals[:, :, 0] / rationals[:, :, 1]
+    for meta, lat, lng, (focal, heading, altitude) in zip(metas, lats, lngs, values):
+        meta["lat"]         = float(lat)
+        meta["lng"]         = float(lng)
+        meta["focallength"] = float(focal)
+        meta["heading"]     = float(heading)
+        meta["altitude"]    = float(altitude)
+
+
+class ImageMeta:
     @staticmethod
     def __get_exif(filename):
         """
-        Function to read exif data from the image file
+        Function to read exif data from the image file.
+        Only the APP1 (EXIF) segment of the file is parsed; no image
+        decoder or pixel buffer is ever constructed for a metadata read,
+        and only the head of the file is read from disk.
         """
-        image = Image.open(filename)
-        image.verify()
-        return image._getexif()
+        with open(filename, 'rb') as f:
+            head = f.read(HEADER_BYTES)
+        try:
+            raw = piexif.load(head)
+        except Exception:
+            # Rare file with the APP1 segment past the first 64 KiB;
+            # fall back to parsing the whole file
+            raw = piexif.load(filename)
+        data = {key: _decode(val) for key, val in raw["0th"].items()}
+        data.update((key, _decode(val)) for key, val in raw["Exif"].items())
+        # Drop the raw IFD pointers and attach the GPS sub-IFD as a dict,
+        # so the callers see one flat mapping with numeric tag ids
+        data.pop(0x8769, None)
+        data.pop(0x8825, None)
+        if raw["GPS"]:
+            data[0x8825] = {key: _decode(val) for key, val in raw["GPS"].items()}
+        return data or None
 
     @staticmethod
     def __get_geotagging(exif):
@@ -30,16 +245,10 @@ class ImageMeta:
         """
         if not exif:
             raise ValueError("No EXIF metadata found")
-        geotagging = {}
-        for (idx, tag) in TAGS.items():
-            if tag == 'GPSInfo':
-                if idx not in exif:
-                    raise ValueError("No EXIF geotagging found")
-
-                for (key, val) in GPSTAGS.items():
-                    if key in exif[idx]:
-                        geotagging[val] = exif[idx][key]
-        return geotagging
+        gps_ifd = exif.get(GPSINFO_TAG)
+        if not gps_ifd:
+            raise ValueError("No EXIF geotagging found")
+        return {GPSTAGS[key]: val for key, val in gps_ifd.items() if key in GPSTAGS}
 
     @staticmethod
     def __get_decimal_from_dms(dms, ref) -> float:
@@ -63,7 +272,48 @@ class ImageMeta:
             seconds = -seconds
         return round(degrees + minutes + seconds, 6)
 
-    
+    @classmethod
+    def _extract(cls, filename:str):
+        """
+        Parse one image and return (meta, raw), where meta holds the
+        fields that are already in their final form and raw holds the
+        rational EXIF numbers that still need converting to floats:
+        (lat_dms, lat_ref, lng_dms, lng_ref, focallength, heading, altitude)
+        """
+        # Check if the file exits
+        _check_file_exists(filename)
+
+        # Read image and load exif data
+        exif = cls.__get_exif(filename)
+
+        # Get Geographic metadata
+        geotags = cls.__get_geotagging(exif)
+        # print(int.from_bytes(geotags["GPSAltitudeRef"], byteorder="little"))
+
+        # Look the consumed tags up by id directly on the exif mapping
+        meta = dict()
+        meta["datetime"]  = exif[WANTED_TAGS["DateTimeOriginal"]]
+        meta["imgwidth"]  = exif[WANTED_TAGS["ImageWidth"]]
+        meta["imgheight"] = exif[WANTED_TAGS["ImageLength"]]
+
+        # Get Yaw, pitch and roll
+        split_string = _USER_COMMENT_SPLIT.split(exif[WANTED_TAGS["UserComment"]])
+        meta["yaw"]   = float(split_string[4])
+        meta["pitch"] = float(split_string[6])
+        meta["roll"]  = float(split_string[8])
+
+        # Camera Sensor length/width for known devices
+        spec = SENSOR_SPECS.get((exif[WANTED_TAGS["Make"]].lower(),
+                                 exif[WANTED_TAGS["Model"]].lower()))
+        if spec:
+            meta.update(spec)
+
+        raw = (geotags["GPSLatitude"], geotags["GPSLatitudeRef"],
+               geotags["GPSLongitude"], geotags["GPSLongitudeRef"],
+               exif[WANTED_TAGS["FocalLength"]], geotags["GPSImgDirection"],
+               geotags["GPSAltitude"])
+        return meta, raw
+
     @classmethod
     def readfromimage(cls, filename:str) -> dict:
         """
@@ -73,8 +323,8 @@ class ImageMeta:
             filename(str):  Full file path of the image to read
 
         RETURN:
-            <dict>
-            Returns a dict with 
+            <ImageRow>
+            Returns a named tuple (use ._asdict() for a dict view) with
                 datetime:       DateTime for the image taken
                 framewidth:     Width of the image
                 frameheight:    Height of the image
@@ -90,45 +340,16 @@ class ImageMeta:
                 senheight:      Camera sensor array height.
                 h_fov:          Horizontal field of view for the camera in potrait mode.
         """
-        # Check if the file exits
-        cls.__checkifileexist(filename)
-
-        # Read image and load exif data
-        exif = cls.__get_exif(filename)
-        # Get labels for each entry in data
-        labeled_exif = {}
-        for (key, val) in exif.items():
-            labeled_exif[TAGS.get(key)] = val
-
-        # Get Geographic metadata
-        geotags = cls.__get_geotagging(exif)
-        # print(int.from_bytes(geotags["GPSAltitudeRef"], byteorder="little"))
-        
-        # Capture only few data and return as a dict
-        ret = dict()
-        ret["datetime"]    = labeled_exif["DateTimeOriginal"]
-        ret["imgwidth"]    = labeled_exif["ImageWidth"]
-        ret["imgheight"]   = labeled_exif["ImageLength"]
-        ret["focallength"] = labeled_exif["FocalLength"][0]/labeled_exif["FocalLength"][1]
-        ret["lat"]         = cls.__get_decimal_from_dms(geotags["GPSLatitude"], geotags["GPSLatitudeRef"])
-        ret["lng"]         = cls.__get_decimal_from_dms(geotags["GPSLongitude"], geotags["GPSLongitudeRef"])
-        ret["heading"]     = geotags["GPSImgDirection"][0]/geotags["GPSImgDirection"][1]
-        ret["altitude"]    = geotags["GPSAltitude"][0]/geotags["GPSAltitude"][1]
+        meta, raw = cls._extract(filename)
+        lat_dms, lat_ref, lng_dms, lng_ref, focal, heading, altitude = raw
 
-        # Get Yaw, pitch and roll
-        split_string = re.split("[\x00^:,]", labeled_exif["UserComment"])
-        ret["yaw"]   = float(split_string[4])
-        ret["pitch"] = float(split_string[6])
-        ret["roll"]  = float(split_string[8])
-
-        # Camera Sensor length/width
-        # These values are hard-coded for Samsung SM-A505F mobiles
-        if (labeled_exif["Make"].lower() == "samsung") and labeled_exif["Model"].lower() == "sm-a505f":
-            ret["senwidth"]  = 5.18 # millimeters
-            ret["senheight"] = 3.89 # millimeters
-            ret["h_fov"]     = 66.8 # degrees - Field of view
-
-        return ret
+        # Convert the rational numbers the scalar way for a single image
+        meta["focallength"] = focal[0]/focal[1]
+        meta["lat"]         = cls.__get_decimal_from_dms(lat_dms, lat_ref)
+        meta["lng"]         = cls.__get_decimal_from_dms(lng_dms, lng_ref)
+        meta["heading"]     = heading[0]/heading[1]
+        meta["altitude"]    = altitude[0]/altitude[1]
+        return ImageRow(imgname=os.path.basename(filename), **meta)
     
     @classmethod
     def readfrombatch(cls, listofimg:list, csvwrite=False):
@@ -142,33 +363,44 @@ class ImageMeta:
         """
         print("[INFO] Reading EXIF data, ", end=" ")
         metaData = list()
-        for filepath in listofimg:
-            # Check if the file exits
-            cls.__checkifileexist(filepath)
-            meta = cls.readfromimage(filepath)
-            meta["imgname"] = os.path.basename(filepath)
-            metaData.append(meta)
+        misses = list()
+        with shelve.open(CACHE_FILE) as cache:
+            # Serve unchanged images straight from the cache; only new or
+            # modified files need to be parsed again
+            keys = {filepath: _cache_key(filepath) for filepath in listofimg}
+            for filepath in listofimg:
+                if keys[filepath] in cache:
+                    metaData.append(cache[keys[filepath]])
+                else:
+                    misses.append(filepath)
+
+            # The images are independent of each other, so the batch is spread
+            # over all CPU cores. Images are handed out in chunks so that the
+            # pool overhead is amortized over many images per worker.
+            if misses:
+                parsed = list()
+                raws = list()
+                with multiprocessing.Pool(os.cpu_count()) as pool:
+                    for filepath, meta, raw in pool.imap_unordered(_readone, misses, chunksize=16):
+                        parsed.append((keys[filepath], meta))
+                        raws.append(raw)
+
+                # Convert the rational numbers for all parsed images in
+                # one vectorized pass instead of per-image Python math
+                _finalize_batch([meta for _, meta in parsed], raws)
+                for key, meta in parsed:
+                    row = ImageRow(**meta)
+                    cache[key] = row
+                    metaData.append(row)
         print("Done!")
 
         if csvwrite:
             # Write to csv
             print("[INFO] Saving to csv, ", end=" ")
-            csv_columns = ['datetime','imgwidth','imgheight', 'focallength',\
-                        'lat', 'lng', 'heading', 'altitude', 'yaw', 'pitch', 'roll', 'senwidth', 'senheight', 'h_fov', 'imgname']
             csv_file = "metaData-images.csv"
-            
-            while True:
-                try:
-                    with open(csv_file, 'w') as csvfile:
-                        writer = csv.DictWriter(csvfile, fieldnames=csv_columns)
-                        writer.writeheader()
-                        for data in metaData:
-                            writer.writerow(data)
-                    print("Done!")
-                    print("CSV saved as ", csv_file)
-                    break
-                except IOError:
-                    input("Could not open file! Please close Excel. Press Enter to retry.")
+            _write_csv_atomic(metaData, IMAGE_CSV_COLUMNS, csv_file)
+            print("Done!")
+            print("CSV saved as ", csv_file)
         return metaData
 
 
@@ -176,13 +408,6 @@ class VideoMeta:
     def __init__(self, ):
         pass
 
-    @staticmethod
-    def __checkifileexist(filepath):
-        if os.path.isfile(filepath):
-            pass
-        else:
-            raise ValueError("No file found with path {}".format(filepath))
-
     @classmethod
     def readfromsrt(cls, srtfilepath:str, csvwrite=False):
         """Function to read the meta data from OpenCamera .srt files 
@@ -201,53 +426,49 @@ class VideoMeta:
         """
         metaData = list()
         # Check if the file exits
-        cls.__checkifileexist(srtfilepath)
+        _check_file_exists(srtfilepath)
 
-        # Reading the file
+        # Reading the file one subtitle block at a time. The DMS readings
+        # are only collected here; the arithmetic runs in one compiled
+        # pass over the whole file afterwards.
         print("[INFO] Reading .srt data, ", end=" ")
+        lat_raw = list()
+        lng_raw = list()
         with open(srtfilepath, "r") as f:
-            data = f.readlines()
-
-        counter = 1
-        for itr, line in enumerate(data):
-            try:
-                if int(line) == counter:
-                    counter += 1
-                    loc    = re.split('[°\'\"\,\ ]', data[itr+3])
-                    s_time = data[itr+1].split("-->")[0].split(" ")[0]
-                    e_time = data[itr+1].split("-->")[1].split("\n")[0] 
-
-                    ret = dict()
-                    ret["datetime"]    = data[itr+2].split("\n")[0]
-                    ret["lat"]         = round(float(int(loc[:3][0]) + int(loc[:3][1])/60 + int(loc[:3][2])/3600), 6)
-                    ret["lng"]         = round(float(int(loc[5:8][0]) + int(loc[5:8][1])/60 + int(loc[5:8][2])/3600), 6)
-                    ret["heading"]     = float(loc[12])
-                    ret["altitude"]    = float(loc[10].split("m")[0])
-                    ret["frame_start"] = datetime.datetime.strptime(s_time, "%H:%M:%S,%f")
-                    ret["frame_end"]   = datetime.datetime.strptime(e_time, " %H:%M:%S,%f")
-                    metaData.append(ret)
-            except ValueError as e:
-                pass
+            for block in _iter_srt_blocks(f):
+                # A block is index, time span, datetime and location lines
+                if len(block) < 4:
+                    continue
+                loc    = _SRT_LOC_SPLIT.split(block[3])
+                s_time = block[1].split("-->")[0].strip()
+                e_time = block[1].split("-->")[1].strip()
+
+                ret = dict()
+                ret["datetime"]    = block[2]
+                ret["heading"]     = float(loc[12])
+                ret["altitude"]    = float(loc[10].split("m")[0])
+                ret["frame_start"] = _parse_srt_time(s_time)
+                ret["frame_end"]   = _parse_srt_time(e_time)
+                lat_raw.append((int(loc[0]), int(loc[1]), int(loc[2])))
+                lng_raw.append((int(loc[5]), int(loc[6]), int(loc[7])))
+                metaData.append(ret)
+
+        # Convert all the DMS readings of the file in one JIT-compiled
+        # pass and freeze the frames into row tuples
+        if metaData:
+            lats = np.round(_dms_to_dec(np.array(lat_raw, dtype=np.int32)), 6)
+            lngs = np.round(_dms_to_dec(np.array(lng_raw, dtype=np.int32)), 6)
+            metaData = [VideoRow(lat=float(lat), lng=float(lng), **ret)
+                        for ret, lat, lng in zip(metaData, lats, lngs)]
         print("Done!")
         
         if csvwrite:
             # Write to csv
             print("saving to csv, ", end=" ")
-            csv_columns = ['datetime', 'lat', 'lng', 'heading', 'altitude', 'frame_start', 'frame_end']
             csv_file = "metaData-{}.csv".format(os.path.basename(srtfilepath).split(".")[0])
-            
-            while True:
-                try:
-                    with open(csv_file, 'w') as csvfile:
-                        writer = csv.DictWriter(csvfile, fieldnames=csv_columns)
-                        writer.writeheader()
-                        for data in metaData:
-                            writer.writerow(data)
-                    print("Done!")
-                    print("CSV saved as ", csv_file)
-                    break
-                except IOError:
-                    input("Could not open file! Please close Excel. Press Enter to retry.")
+            _write_csv_atomic(metaData, VIDEO_CSV_COLUMNS, csv_file)
+            print("Done!")
+            print("CSV saved as ", csv_file)
 
         return metaData
 
@@ -263,8 +484,12 @@ if __name__ == "__main__":
     # print(ImageMeta.readfromimage(image_file_path))
 
     # # Read meta from batch of images and save as csv
+    # # scandir reuses the stat info the kernel already returned and the
+    # # extension filter keeps non-image files (Thumbs.db etc.) out of the batch
     # folderPath = "images/"
-    # image_path_list = [os.path.join(folderPath, filename) for filename in os.listdir(folderPath)]
+    # with os.scandir(folderPath) as it:
+    #     image_path_list = [entry.path for entry in it
+    #                        if entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg'))]
     # data = ImageMeta.readfrombatch(image_path_list)
     # for line in data:
     #     print(line)